@@ -1,18 +1,58 @@
 #!/usr/bin/env python3
 from flask import Flask, render_template_string, request, send_file, jsonify
 import fitz  # PyMuPDF
-from PIL import Image
+import pikepdf
+try:
+    import pypdfium2 as pdfium
+except ImportError:
+    pdfium = None
+from reportlab import rl_config
 from reportlab.pdfgen import canvas
 from reportlab.lib.pagesizes import letter
 from reportlab.lib.utils import ImageReader
+import gc
+import hashlib
+import io
+import math
 import os
 import tempfile
+import socket
 import subprocess
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import ExitStack, contextmanager
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from werkzeug.utils import secure_filename
+from unoserver.client import UnoClient
 
 app = Flask(__name__)
 app.config['MAX_CONTENT_LENGTH'] = 50 * 1024 * 1024
-app.config['UPLOAD_FOLDER'] = tempfile.gettempdir()
+
+CACHE_DIR = os.environ.get('CACHE_DIR', os.path.join(tempfile.gettempdir(), 'slide-optimizer-cache'))
+CACHE_MAX_FILES = int(os.environ.get('CACHE_MAX_FILES', 200))
+os.makedirs(CACHE_DIR, exist_ok=True)
+
+# unoserver must run under a Python that can import LibreOffice's `uno` module
+UNO_PYTHON = os.environ.get('UNO_PYTHON', 'python3')
+OFFICE_PORT = int(os.environ.get('OFFICE_PORT', 2003))
+
+PAGE_W, PAGE_H = letter
+MARGIN, GAP = 36, 12
+RENDER_WORKERS = int(os.environ.get('RENDER_WORKERS', os.cpu_count() or 1))
+RENDER_AHEAD = 8
+STORE_SHRINK_EVERY = 20
+# Pages with no raster images are only text and shapes, which stay legible
+# at a lower resolution than photos and screenshots need
+VECTOR_DPI_SCALE = 0.75
+# Output pages per reportlab canvas before it's flushed to disk
+CHUNK_PAGES = int(os.environ.get('CHUNK_PAGES', 50))
+# Default rasterizer for the render workers: pymupdf or pypdfium2
+RENDERER = os.environ.get('RENDERER', 'pymupdf')
+# reportlab wraps embedded JPEGs in ASCII85 by default, a quarter more bytes
+# that nothing downstream removes
+rl_config.useA85 = 0
 
 HTML_TEMPLATE = """
 <!doctype html>
@@ -61,6 +101,7 @@ HTML_TEMPLATE = """
               <option value="2">2 Slides</option>
               <option value="4">4 Slides</option>
               <option value="6">6 Slides</option>
+              <option value="9">9 Slides</option>
             </select>
           </div>
           <div>
@@ -68,6 +109,14 @@ HTML_TEMPLATE = """
             <input id="dpi" type="number" value="200" max="300" class="input-field w-full p-3 rounded text-sm" />
           </div>
         </div>
+
+        <div>
+          <label class="block text-[10px] font-bold text-zinc-600 uppercase mb-2 tracking-widest">Rendering</label>
+          <select id="mode" class="input-field w-full p-3 rounded text-sm">
+            <option value="raster" selected>Raster (uses DPI)</option>
+            <option value="vector">Vector (source pages, no DPI)</option>
+          </select>
+        </div>
       </div>
 
       <button id="processBtn" class="btn-primary w-full mt-10 py-4 rounded text-[11px] font-bold tracking-[0.25em] uppercase shadow-lg">
@@ -75,7 +124,7 @@ HTML_TEMPLATE = """
       </button>
 
       <div id="status" class="mt-6 hidden text-center">
-        <span class="text-[10px] uppercase tracking-widest text-zinc-600 animate-pulse">Reconstructing document...</span>
+        <span id="statusText" class="text-[10px] uppercase tracking-widest text-zinc-600 animate-pulse">Reconstructing document...</span>
       </div>
     </div>
 
@@ -116,15 +165,31 @@ HTML_TEMPLATE = """
         formData.append('file', selectedFile);
         formData.append('slides_per_page', $('slidesPerPage').value);
         formData.append('dpi', dpiVal);
+        formData.append('mode', $('mode').value);
         formData.append('out_name', $('outName').value || "optimized_handout");
 
+        $('statusText').textContent = "Reconstructing document...";
         $('status').classList.remove('hidden');
         $('processBtn').disabled = true;
 
         try {
-            const response = await fetch('/optimize', { method: 'POST', body: formData });
+            const submit = await fetch('/optimize', { method: 'POST', body: formData });
+            if (submit.status === 503) throw new Error("Server busy, try again shortly");
+            if (!submit.ok) throw new Error("Processing failure");
+            const { job_id } = await submit.json();
+
+            while (true) {
+                const poll = await fetch('/status/' + job_id);
+                if (!poll.ok) throw new Error("Processing failure");
+                const job = await poll.json();
+                if (job.state === 'error') throw new Error("Processing failure");
+                $('statusText').textContent = "Reconstructing document... " + Math.round(job.progress * 100) + "%";
+                if (job.state === 'done') break;
+                await new Promise(r => setTimeout(r, 500));
+            }
+
+            const response = await fetch('/result/' + job_id);
             if (!response.ok) throw new Error("Processing failure");
-            
             const blob = await response.blob();
             const url = window.URL.createObjectURL(blob);
             const a = document.createElement('a');
@@ -142,75 +207,413 @@ HTML_TEMPLATE = """
 </html>
 """
 
-def process_file(input_pdf, output_pdf, slides_per_page, dpi):
-    dpi = min(int(dpi), 300)
-    pdf_document = fitz.open(input_pdf)
-    total_slides = len(pdf_document)
-    
-    # Render first page to determine orientation for "Auto" mode
-    zoom = dpi / 72
-    mat = fitz.Matrix(zoom, zoom)
-    images = []
-    for page in pdf_document:
-        pix = page.get_pixmap(matrix=mat)
-        img = Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
-        images.append(img)
-    
-    img_w, img_h = images[0].size
-    is_landscape = img_w > img_h
-    pdf_document.close()
+_office = None
+_office_lock = threading.Lock()
+
+def _office_up():
+    try:
+        socket.create_connection(('127.0.0.1', OFFICE_PORT), timeout=1).close()
+        return True
+    except OSError:
+        return False
+
+def _ensure_office():
+    # One long-lived LibreOffice per host: whichever worker's server holds the
+    # port serves everyone, so only start ours when nothing answers there.
+    global _office
+    if _office_up():
+        return
+    if _office is not None and _office.poll() is not None:
+        _office.wait()
+        _office = None
+    if _office is None:
+        _office = subprocess.Popen([UNO_PYTHON, '-m', 'unoserver.server', '--port', str(OFFICE_PORT), '--uno-port', str(OFFICE_PORT - 1)])
+    deadline = time.monotonic() + 60
+    while not _office_up():
+        if time.monotonic() > deadline:
+            raise RuntimeError("LibreOffice conversion server did not start")
+        time.sleep(0.2)
+
+def convert_to_pdf(data):
+    # soffice handles one document at a time
+    with _office_lock:
+        _ensure_office()
+        # Bytes go over the RPC both ways, so nothing is written to disk
+        return UnoClient(port=str(OFFICE_PORT)).convert(indata=data, convert_to='pdf')
+
+def _open_pdf(src):
+    # Uploads arrive as bytes; a path still works for local use
+    return fitz.open(stream=src) if isinstance(src, bytes) else fitz.open(src)
+
+# Jobs live in this process, so status polling needs a single app worker
+_jobs = {}
+_jobs_lock = threading.Lock()
+# Finished jobs whose result is never fetched are dropped after this long
+JOB_TTL = int(os.environ.get('JOB_TTL', 600))
+# Queued jobs each hold their upload in memory (up to MAX_CONTENT_LENGTH)
+MAX_PENDING_JOBS = int(os.environ.get('MAX_PENDING_JOBS', 4))
+# PyMuPDF here is single-threaded and not safe to call from two threads at
+# once, and raster jobs fork their render pool; one job runs at a time
+_job_pool = ThreadPoolExecutor(max_workers=1)
+
+_worker_doc = None
+_worker_pages = 0
+_worker_backend = RENDERER
+_worker_sent = set()
+
+def _open_worker_doc(input_pdf, backend):
+    # Documents can't be pickled, so each worker process opens the source
+    # once and keeps it for every page it's handed.
+    global _worker_doc, _worker_backend
+    _worker_backend = backend
+    if backend == 'pypdfium2':
+        _worker_doc = pdfium.PdfDocument(input_pdf)
+    else:
+        _worker_doc = _open_pdf(input_pdf)
+
+def _digest(data):
+    return hashlib.blake2b(data, digest_size=16).digest()
 
+def _once(chunk, digest, encode):
+    # Lecture decks repeat slides; pixels this worker already sent in the
+    # same output chunk only need their digest. Workers take pages in order
+    # and the parent consumes them in order, so the parent has drawn the
+    # earlier copy by the time it sees this.
+    if (chunk, digest) in _worker_sent:
+        return digest, None
+    _worker_sent.add((chunk, digest))
+    return digest, encode()
+
+def _tile_zoom(page_w, page_h, sw, sh, dpi):
+    # min() keeps the pixmap inside the tile, so a page whose aspect ratio
+    # differs from the first page's can't blow up to an oversized render
+    return min(sw / page_w, sh / page_h) * dpi / 72
+
+def _full_page_image(page, images):
+    # Scans and image exports are often a single upright full-page image with
+    # nothing drawn over it; returns that image's get_images() entry.
+    if len(images) != 1 or page.rotation or page.get_text("text").strip():
+        return None
+    placements = page.get_image_rects(images[0][0], transform=True)
+    if len(placements) != 1:
+        return None
+    bbox, m = placements[0]
+    if m.b or m.c or m.a <= 0 or m.d <= 0 or (bbox & page.rect).get_area() < 0.95 * page.rect.get_area():
+        return None
+    return images[0]
+
+def _page_jpeg(image, max_width):
+    # A plain JPEG can be embedded as-is without rendering. Anything else would
+    # be re-encoded by extract_image, or is much larger than the tile needs.
+    xref, smask = image[0], image[1]
+    if smask:
+        return None
+    info = _worker_doc.extract_image(xref)
+    if info['ext'] != 'jpeg' or info['colorspace'] not in (1, 3) or info['width'] > 1.5 * max_width:
+        return None
+    return info['image']
+
+def _jpeg(pix, jpg_quality):
+    # Most lecture slides are black text on white. A pixmap with no colour at
+    # all survives RGB -> gray -> RGB unchanged, and then encodes as a
+    # one-channel JPEG: a third of the encode work and fewer embedded bytes.
+    gray = fitz.Pixmap(fitz.csGRAY, pix)
+    back = fitz.Pixmap(fitz.csRGB, gray)
+    if back.samples_mv == pix.samples_mv:
+        pix = gray
+    return pix.tobytes("jpeg", jpg_quality=jpg_quality)
+
+_MATRIX_CACHE = {}
+
+def _mat(zoom):
+    # Pages of one deck nearly always share a size, hence a zoom
+    m = _MATRIX_CACHE.get(zoom)
+    if m is None:
+        m = _MATRIX_CACHE[zoom] = fitz.Matrix(zoom, zoom)
+    return m
+
+def _render_page_pdfium(page_index, sw, sh, dpi, jpg_quality, chunk):
+    page = _worker_doc[page_index]
+    if next(page.get_objects(filter=(pdfium.raw.FPDF_PAGEOBJ_IMAGE,)), None) is None:
+        dpi *= VECTOR_DPI_SCALE
+    zoom = _tile_zoom(*page.get_size(), sw, sh, dpi)
+    out = io.BytesIO()
+    # RGBX is a layout PIL can wrap without copying, and its JPEG encoder
+    # reads it directly; the default BGR bitmap is converted into a new buffer.
+    bitmap = page.render(scale=zoom, rev_byteorder=True, prefer_bgrx=True)
+    def encode():
+        bitmap.to_pil().save(out, 'JPEG', quality=jpg_quality)
+        return out.getvalue()
+    return _once(chunk, _digest(bitmap.buffer), encode)
+
+def _render_page(args):
+    global _worker_pages
+    page_index, sw, sh, dpi, jpg_quality, chunk = args
+    if _worker_backend == 'pypdfium2':
+        return _render_page_pdfium(page_index, sw, sh, dpi, jpg_quality, chunk)
+    page = _worker_doc[page_index]
+    images = page.get_images(full=True)
+    if not images:
+        dpi *= VECTOR_DPI_SCALE
+    zoom = _tile_zoom(page.rect.width, page.rect.height, sw, sh, dpi)
+    image = _full_page_image(page, images)
+    if image is not None:
+        jpg = _page_jpeg(image, page.rect.width * zoom)
+        if jpg is not None:
+            return _once(chunk, _digest(jpg), lambda: jpg)
+        # Rendering past the image's own resolution adds pixels, not detail
+        zoom = min(zoom, image[2] / page.rect.width)
+    pix = page.get_pixmap(matrix=_mat(zoom))
+    # Only the digest and encoded JPEG cross back to the parent
+    result = _once(chunk, _digest(pix.samples_mv), lambda: _jpeg(pix, jpg_quality))
+    pix = None
+    # MuPDF's store keeps decoded fonts/images for the life of the worker;
+    # PyMuPDF can't cap it, so empty it every few pages instead.
+    _worker_pages += 1
+    if _worker_pages % STORE_SHRINK_EVERY == 0:
+        fitz.TOOLS.store_shrink(100)
+    return result
+
+def _layout(slides_per_page, img_w, img_h):
     # Automatic Logic
     if slides_per_page == 'auto':
-        s_p_p = 2 if is_landscape else 4
+        s_p_p = 2 if img_w > img_h else 4
     else:
-        s_p_p = int(slides_per_page)
+        s_p_p = max(1, min(int(slides_per_page), 9))
 
-    page_width, page_height = letter
-    layouts = {1:(1,1), 2:(1,2), 4:(2,2), 6:(2,3)}
-    cols, rows = layouts.get(s_p_p, (2,2))
+    # 1x1, 1x2, 2x2, 2x3, 3x3; other counts round down to the grid they fit
+    cols = 1 if s_p_p == 2 else math.isqrt(s_p_p)
+    rows = s_p_p // cols
+    s_p_p = cols*rows
     
-    margin, gap = 36, 12
-    cw = (page_width - (2*margin) - (cols-1)*gap) / cols
-    ch = (page_height - (2*margin) - (rows-1)*gap) / rows
+    cw = (PAGE_W - (2*MARGIN) - (cols-1)*GAP) / cols
+    ch = (PAGE_H - (2*MARGIN) - (rows-1)*GAP) / rows
     
     scale = min(cw/img_w, ch/img_h)
     sw, sh = img_w*scale, img_h*scale
+    # Tile origins only depend on the slot, so compute them once (reportlab coordinates)
+    positions = [(MARGIN + (j%cols)*(cw+GAP) + (cw-sw)/2,
+                  PAGE_H - MARGIN - ((j//cols)+1)*ch - (j//cols)*GAP + (ch-sh)/2) for j in range(s_p_p)]
+    return s_p_p, positions, sw, sh
+
+@contextmanager
+def _gstate(c):
+    # Scopes transforms and colour changes to one q ... Q block of the content stream
+    c.saveState()
+    try:
+        yield
+    finally:
+        c.restoreState()
 
-    c = canvas.Canvas(output_pdf, pagesize=letter)
-    idx = 0
-    while idx < total_slides:
-        for j in range(s_p_p):
-            if idx >= total_slides: break
-            col, row = j % cols, j // cols
-            x = margin + col*(cw+gap) + (cw-sw)/2
-            y = page_height - margin - (row+1)*ch - row*gap + (ch-sh)/2
-            c.drawImage(ImageReader(images[idx]), x, y, width=sw, height=sh)
-            c.setStrokeColorRGB(0.2, 0.2, 0.2)
-            c.rect(x, y, sw, sh)
-            idx += 1
-        c.showPage()
-    c.save()
+def _dedupe_slide_images(pdf):
+    # Each chunk embeds its own copy of a slide that repeats across chunks;
+    # point every copy at the first one so only it gets written
+    seen = {}
+    for page in pdf.pages:
+        for form in page.Resources.XObject.values():
+            images = form.Resources.XObject
+            for name, image in images.items():
+                images[name] = seen.setdefault(_digest(image.read_raw_bytes()), image)
+
+def process_file(input_pdf, output_pdf, slides_per_page, dpi, progress=None, jpg_quality=85, backend=RENDERER):
+    dpi = max(36, min(int(dpi or 200), 300))
+    if backend == 'pypdfium2' and pdfium is None:
+        backend = 'pymupdf'
+    with _open_pdf(input_pdf) as pdf_document:
+        total_slides = len(pdf_document)
+        # First page determines orientation for "Auto" mode
+        img_w, img_h = pdf_document[0].rect.width, pdf_document[0].rect.height
+    s_p_p, positions, sw, sh = _layout(slides_per_page, img_w, img_h)
+
+    # Pages are drawn as soon as they come back, so only in-flight JPEGs are held.
+    # The output is written as CHUNK_PAGES-page PDFs on disk, so reportlab's
+    # object tree never covers more than one chunk of a huge deck. Content
+    # streams are compressed in one pass by pikepdf when the chunks are joined.
+    with ExitStack() as chunks:
+        files = []
+        def new_canvas():
+            files.append(chunks.enter_context(tempfile.TemporaryFile()))
+            return canvas.Canvas(files[-1], pagesize=letter, pageCompression=0)
+        c = new_canvas()
+        # Each distinct slide image becomes a form XObject drawn once per chunk.
+        # Only digests are kept, not ImageReaders, which would pin every slide's
+        # decoded pixels. Workers send no JPEG for pixels they've already sent
+        # in the same chunk.
+        forms = {}
+        workers = min(RENDER_WORKERS, total_slides)
+        with ProcessPoolExecutor(max_workers=workers, initializer=_open_worker_doc, initargs=(input_pdf, backend)) as ex:
+            submit = lambda i: ex.submit(_render_page, (i, sw, sh, dpi, jpg_quality, i // s_p_p // CHUNK_PAGES))
+            # Workers stay a bounded number of pages ahead of the canvas, so
+            # finished JPEGs can't pile up if drawing falls behind.
+            ahead = max(RENDER_AHEAD, 2 * workers)
+            pending = deque(submit(i) for i in range(min(ahead, total_slides)))
+            for idx in range(total_slides):
+                key, jpg = pending.popleft().result()
+                if idx + ahead < total_slides:
+                    pending.append(submit(idx + ahead))
+                name = forms.get(key)
+                if name is None:
+                    name = forms[key] = f"slide{len(forms)}"
+                    c.beginForm(name, upperx=sw, uppery=sh)
+                    c.drawImage(ImageReader(io.BytesIO(jpg)), 0, 0, width=sw, height=sh)
+                    c.endForm()
+                j = idx % s_p_p
+                if j == 0:
+                    # All of a page's borders go out as one path
+                    borders = c.beginPath()
+                x, y = positions[j]
+                with _gstate(c):
+                    c.translate(x, y)
+                    c.doForm(name)
+                borders.rect(x, y, sw, sh)
+                if j == s_p_p - 1 or idx == total_slides - 1:
+                    with _gstate(c):
+                        c.setStrokeColorRGB(0.2, 0.2, 0.2)
+                        c.drawPath(borders, stroke=1, fill=0)
+                    c.showPage()
+                    if (idx // s_p_p + 1) % CHUNK_PAGES == 0 and idx < total_slides - 1:
+                        c.save()
+                        c = new_canvas()
+                        forms = {}
+                if progress:
+                    progress(idx + 1, total_slides)
+        c.save()
+        # Pages copied from a chunk read their streams from it at save time,
+        # so every chunk stays open until the output is written
+        parts = []
+        for f in files:
+            f.seek(0)
+            parts.append(chunks.enter_context(pikepdf.open(f)))
+        pdf = parts[0]
+        for part in parts[1:]:
+            pdf.pages.extend(part.pages)
+        if len(parts) > 1:
+            _dedupe_slide_images(pdf)
+        # Linearized so viewers can show the first page before the download finishes
+        pdf.save(output_pdf, compress_streams=True, object_stream_mode=pikepdf.ObjectStreamMode.generate, linearize=True)
+
+def process_file_vector(input_pdf, output_pdf, slides_per_page, progress=None):
+    # Places the source pages themselves instead of rasterizing them, so text
+    # and shapes stay vector and DPI doesn't apply.
+    with _open_pdf(input_pdf) as src, fitz.open() as out:
+        img_w, img_h = src[0].rect.width, src[0].rect.height
+        s_p_p, positions, sw, sh = _layout(slides_per_page, img_w, img_h)
+        for idx in range(len(src)):
+            j = idx % s_p_p
+            if j == 0:
+                out_page = out.new_page(width=PAGE_W, height=PAGE_H)
+                borders = out_page.new_shape()
+            x, y = positions[j]
+            # fitz measures y from the top edge
+            y = PAGE_H - y - sh
+            rect = fitz.Rect(x, y, x + sw, y + sh)
+            out_page.show_pdf_page(rect, src, idx)
+            borders.draw_rect(rect)
+            if j == s_p_p - 1 or idx == len(src) - 1:
+                borders.finish(color=(0.2, 0.2, 0.2))
+                borders.commit()
+            if progress:
+                progress(idx + 1, len(src))
+        out.save(output_pdf, garbage=4, deflate=True)
+    # This runs in the long-lived server process, whose MuPDF store would
+    # otherwise keep every vector job's fonts and images until it hit the
+    # 256 MiB default (the store limit can't be changed from Python)
+    fitz.TOOLS.store_shrink(100)
+    gc.collect()
 
 @app.route('/')
 def index():
     return render_template_string(HTML_TEMPLATE)
 
+def _prune_cache():
+    entries = [e for e in os.scandir(CACHE_DIR) if e.name.endswith('.pdf')]
+    if len(entries) > CACHE_MAX_FILES:
+        entries.sort(key=lambda e: e.stat().st_atime)
+        for entry in entries[:len(entries) - CACHE_MAX_FILES]:
+            try:
+                os.remove(entry.path)
+            except FileNotFoundError:
+                pass
+
+def _set_job(job_id, **fields):
+    with _jobs_lock:
+        _jobs[job_id].update(fields)
+
+def _expire_jobs():
+    # Called with _jobs_lock held
+    cutoff = time.monotonic() - JOB_TTL
+    for job_id in [k for k, job in _jobs.items() if job.get('finished', cutoff) < cutoff]:
+        del _jobs[job_id]
+
+def _run_job(job_id, data, filename, cached, mode, slides_per_page, dpi):
+    progress = lambda done, total: _set_job(job_id, progress=done / total)
+    tmp = f"{cached}.{uuid.uuid4().hex}.tmp"
+    try:
+        if filename.lower().endswith(('.pptx', '.ppt')):
+            data = convert_to_pdf(data)
+
+        if mode == 'vector':
+            process_file_vector(data, tmp, slides_per_page, progress)
+        else:
+            process_file(data, tmp, slides_per_page, dpi, progress)
+        os.replace(tmp, cached)
+        _prune_cache()
+        # The result is served from the cache, so no PDF is held in _jobs
+        _set_job(job_id, state='done', progress=1.0, result=cached, finished=time.monotonic())
+    except Exception:
+        app.logger.exception("Job %s failed", job_id)
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        _set_job(job_id, state='error', finished=time.monotonic())
+
 @app.route('/optimize', methods=['POST'])
 def optimize():
     file = request.files.get('file')
     custom_name = secure_filename(request.form.get('out_name', 'optimized_handout'))
     filename = secure_filename(file.filename)
-    input_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-    file.save(input_path)
+    mode, slides_per_page, dpi = request.form.get('mode'), request.form.get('slides_per_page'), request.form.get('dpi')
+    # Uploads are capped by MAX_CONTENT_LENGTH, so they stay in memory
+    data = file.read()
+    h = hashlib.blake2b(data, digest_size=16)
+    # Options are hashed in too so form values never end up in a path
+    h.update(f"|{mode}|{slides_per_page}|{dpi}".encode())
+    cached = os.path.join(CACHE_DIR, f"{h.hexdigest()}.pdf")
+
+    job_id = uuid.uuid4().hex
+    job = {'state': 'running', 'progress': 0.0, 'name': f"{custom_name}.pdf"}
+    if os.path.exists(cached):
+        os.utime(cached)  # atime isn't reliable on relatime mounts
+        job.update(state='done', progress=1.0, result=cached, finished=time.monotonic())
+    with _jobs_lock:
+        _expire_jobs()
+        if job['state'] == 'running' and sum(j['state'] == 'running' for j in _jobs.values()) >= MAX_PENDING_JOBS:
+            return jsonify(error='too many jobs, try again later'), 503
+        _jobs[job_id] = job
+    if job['state'] == 'running':
+        _job_pool.submit(_run_job, job_id, data, filename, cached, mode, slides_per_page, dpi)
+    return jsonify(job_id=job_id), 202
 
-    if filename.lower().endswith(('.pptx', '.ppt')):
-        subprocess.run(['soffice', '--headless', '--convert-to', 'pdf', input_path, '--outdir', app.config['UPLOAD_FOLDER']], check=True)
-        input_path = input_path.rsplit('.', 1)[0] + '.pdf'
+@app.route('/status/<job_id>')
+def status(job_id):
+    with _jobs_lock:
+        job = _jobs.get(job_id)
+        if job is None:
+            return jsonify(error='unknown job'), 404
+        if job['state'] == 'error':
+            del _jobs[job_id]
+        return jsonify(state=job['state'], progress=job['progress'])
 
-    output_path = os.path.join(app.config['UPLOAD_FOLDER'], f"{custom_name}.pdf")
-    process_file(input_path, output_path, request.form.get('slides_per_page'), request.form.get('dpi'))
-    return send_file(output_path, as_attachment=True, download_name=f"{custom_name}.pdf")
+@app.route('/result/<job_id>')
+def result(job_id):
+    with _jobs_lock:
+        job = _jobs.get(job_id)
+        if job is None or job['state'] != 'done':
+            return jsonify(error='result not ready'), 404
+        del _jobs[job_id]
+    if not os.path.exists(job['result']):
+        # Pruned from the cache before it was fetched
+        return jsonify(error='result expired'), 404
+    return send_file(job['result'], mimetype='application/pdf', as_attachment=True, download_name=job['name'])
 
 if __name__ == '__main__':
     port = int(os.environ.get('PORT', 8080))